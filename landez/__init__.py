@@ -16,6 +16,12 @@ DEFAULT_TILE_FORMAT = 'image/png'
 DEFAULT_TILE_SCHEME = 'wmts'
 """ Number of retries for remove tiles downloading """
 DOWNLOAD_RETRIES = 10
+""" Number of retries when remote tiles server cannot be reached """
+DOWNLOAD_CONNECT_RETRIES = 2
+""" Maximum delay in seconds between retries of tiles downloading """
+DOWNLOAD_BACKOFF_MAX = 5
+""" Maximum delay in seconds honored from servers ``Retry-After`` headers """
+DOWNLOAD_RETRY_AFTER_MAX = 10
 """ Path to fonts for Mapnik rendering """
 TRUETYPE_FONTS_PATH = '/usr/share/fonts/truetype/'
 
@@ -1,7 +1,10 @@
 import os
 import re
+import time
 import logging
 import shutil
+import sqlite3
+import threading
 from gettext import gettext as _
 from .util import flip_y
 
@@ -124,4 +127,81 @@ class Disk(Cache):
         try:
             shutil.rmtree(self.folder)
         except OSError:
-            logger.warn(_("%s was missing or read-only.") % self.folder)
+            logger.warning(_("%s was missing or read-only.") % self.folder)
+
+
+class DownloadCache(object):
+    """
+    Keeps downloaded content by URL, in a single SQLite file.
+    Entries older than `ttl` seconds (if any) are expired.
+    """
+    def __init__(self, filename, ttl=None):
+        self.filename = filename
+        self.ttl = ttl
+        self._con = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._con is None:
+            folder = os.path.dirname(self.filename)
+            if folder and not os.path.isdir(folder):
+                os.makedirs(folder)
+            logger.debug(_("Open download cache '%s'") % self.filename)
+            con = sqlite3.connect(self.filename, check_same_thread=False)
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute('PRAGMA synchronous=NORMAL')
+            con.execute('PRAGMA mmap_size=268435456')
+            con.execute('CREATE TABLE IF NOT EXISTS cache (url TEXT PRIMARY KEY, body BLOB, ts INTEGER)')
+            con.execute('CREATE INDEX IF NOT EXISTS cache_ts ON cache (ts)')
+            self._con = con
+        return self._con
+
+    def _expiry(self):
+        if self.ttl is None:
+            return 0
+        return int(time.time() - self.ttl)
+
+    def read(self, url):
+        with self._lock:
+            row = self._connection().execute('SELECT body FROM cache WHERE url=? AND ts>=?',
+                                              (url, self._expiry())).fetchone()
+        if row is None:
+            return None
+        logger.debug(_("Found %s in download cache") % url)
+        return row[0]
+
+    def exists(self, url):
+        with self._lock:
+            row = self._connection().execute('SELECT 1 FROM cache WHERE url=? AND ts>=?',
+                                             (url, self._expiry())).fetchone()
+        return row is not None
+
+    def save(self, body, url):
+        logger.debug(_("Save %s bytes of %s to download cache") % (len(body), url))
+        with self._lock:
+            con = self._connection()
+            con.execute('INSERT OR REPLACE INTO cache (url, body, ts) VALUES (?, ?, ?)',
+                        (url, body, int(time.time())))
+            # Expire a few old entries at each save
+            if self.ttl is not None:
+                con.execute('''DELETE FROM cache WHERE rowid IN
+                               (SELECT rowid FROM cache WHERE ts<? LIMIT 1000)''', (self._expiry(),))
+            con.commit()
+
+    def remove(self, url):
+        with self._lock:
+            con = self._connection()
+            con.execute('DELETE FROM cache WHERE url=?', (url,))
+            con.commit()
+
+    def clean(self):
+        logger.debug(_("Clean-up %s") % self.filename)
+        with self._lock:
+            if self._con is not None:
+                self._con.close()
+                self._con = None
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.remove(self.filename + suffix)
+                except OSError:
+                    pass
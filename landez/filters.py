@@ -40,6 +40,8 @@ class ColorToAlpha(Filter):
         # Copyright (C) 2007-2010 www.stani.be
 
         from PIL import Image, ImageMath
+        # ImageMath.eval() was renamed in Pillow 10.3
+        evaluate = getattr(ImageMath, 'unsafe_eval', None) or ImageMath.eval
 
         def difference1(source, color):
             """When source is bigger than color"""
@@ -52,13 +54,13 @@ class ColorToAlpha(Filter):
         def color_to_alpha(image, color=None):
             image = image.convert('RGBA')
 
-            color = map(float, Filter.string2rgba(self.color))
+            color = [float(c) for c in Filter.string2rgba(self.color)]
             img_bands = [band.convert("F") for band in image.split()]
 
             # Find the maximum difference rate between source and color. I had to use two
             # difference functions because ImageMath.eval only evaluates the expression
             # once.
-            alpha = ImageMath.eval(
+            alpha = evaluate(
                 """float(
                     max(
                         max(
@@ -88,16 +90,16 @@ class ColorToAlpha(Filter):
             )
             # Calculate the new image colors after the removal of the selected color
             new_bands = [
-                ImageMath.eval(
+                evaluate(
                     "convert((image - color) / alpha + color, 'L')",
                     image = img_bands[i],
                     color = color[i],
                     alpha = alpha
                 )
-                for i in xrange(3)
+                for i in range(3)
             ]
             # Add the new alpha band
-            new_bands.append(ImageMath.eval(
+            new_bands.append(evaluate(
                 "convert(alpha_band * alpha, 'L')",
                 alpha = alpha,
                 alpha_band = img_bands[3]
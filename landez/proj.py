@@ -2,6 +2,13 @@ from math import pi, sin, log, exp, atan, tan, ceil
 from gettext import gettext as _
 from . import DEFAULT_TILE_SIZE
 
+has_numpy = False
+try:
+    import numpy
+    has_numpy = True
+except ImportError:
+    pass
+
 DEG_TO_RAD = pi/180
 RAD_TO_DEG = 180/pi
 MAX_LATITUDE = 85.0511287798
@@ -81,7 +88,8 @@ class GoogleProjection(object):
         se = self.unproject_pixels(bottomright, z)
         return nw + se
 
-    def project(self, lng_lat):
+    @staticmethod
+    def project(lng_lat):
         """
         Returns the coordinates in meters from WGS84
         """
@@ -92,6 +100,20 @@ class GoogleProjection(object):
         y = log(tan((pi / 4) + (y / 2)))
         return (x*EARTH_RADIUS, y*EARTH_RADIUS)
 
+    @staticmethod
+    def project_batch(lng_lats):
+        """
+        Returns the list of coordinates in meters from a list of WGS84
+        coordinates, in one vectorized operation if numpy is available
+        """
+        if not has_numpy:
+            return [GoogleProjection.project(lng_lat) for lng_lat in lng_lats]
+        lng_lats = numpy.asarray(lng_lats, dtype=float).reshape(-1, 2)
+        x = lng_lats[:, 0] * DEG_TO_RAD
+        lat = numpy.clip(lng_lats[:, 1], -MAX_LATITUDE, MAX_LATITUDE)
+        y = numpy.log(numpy.tan((pi / 4) + (lat * DEG_TO_RAD / 2)))
+        return list(zip((x * EARTH_RADIUS).tolist(), (y * EARTH_RADIUS).tolist()))
+
     def unproject(self, x_y):
         """
         Returns the coordinates from position in meters
@@ -119,16 +141,17 @@ class GoogleProjection(object):
         for z in self.levels:
             px0 = self.project_pixels(ll0,z)
             px1 = self.project_pixels(ll1,z)
+            n = 1 << z
 
             for x in range(int(px0[0]/self.tilesize),
                            int(ceil(px1[0]/self.tilesize))):
-                if (x < 0) or (x >= 2**z):
+                if (x < 0) or (x >= n):
                     continue
                 for y in range(int(px0[1]/self.tilesize),
                                int(ceil(px1[1]/self.tilesize))):
-                    if (y < 0) or (y >= 2**z):
+                    if (y < 0) or (y >= n):
                         continue
                     if self.scheme == 'tms':
-                        y = ((2**z-1) - y)
+                        y = ((n-1) - y)
                     l.append((z, x, y))
         return l
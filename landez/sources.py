@@ -1,17 +1,44 @@
 import os
-import time
-import zlib
+import queue
+import shutil
+import string
+import itertools
 import sqlite3
 import logging
 import json
+import threading
+import weakref
 from gettext import gettext as _
-from pkg_resources import parse_version
-import urllib.request
-from urllib.parse import urlparse
-from tempfile import NamedTemporaryFile
+from urllib.parse import urlparse, quote
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 from .util import flip_y
 
 
+try:
+    # ISA-L inflate is a drop-in, faster, replacement of zlib
+    from isal import isal_zlib as zlib
+except ImportError:
+    import zlib
+
+try:
+    import orjson
+    _loads = orjson.loads
+
+    def _dumps(obj):
+        return orjson.dumps(obj).decode()
+except ImportError:
+    _loads = json.loads
+
+    def _dumps(obj):
+        # Same output as orjson
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
 has_mapnik = False
 try:
     import mapnik
@@ -20,13 +47,46 @@ except ImportError:
     pass
 
 
-from . import DEFAULT_TILE_FORMAT, DEFAULT_TILE_SIZE, DEFAULT_TILE_SCHEME, DOWNLOAD_RETRIES
+from . import (DEFAULT_TILE_FORMAT, DEFAULT_TILE_SIZE, DEFAULT_TILE_SCHEME,
+               DOWNLOAD_RETRIES, DOWNLOAD_CONNECT_RETRIES,
+               DOWNLOAD_BACKOFF_MAX, DOWNLOAD_RETRY_AFTER_MAX)
 from .proj import GoogleProjection
 
 
 logger = logging.getLogger(__name__)
 
 
+# MBTiles queries, with whitespace already normalized
+_SQL_META = 'SELECT name, value FROM metadata'
+_SQL_ZOOM = 'SELECT DISTINCT(zoom_level) FROM tiles ORDER BY zoom_level'
+# Requested tiles drive the join, so that each one is a full index lookup
+_SQL_TILES = ('WITH req(c, r) AS (VALUES %s) '
+              'SELECT t.tile_column, t.tile_row, t.tile_data FROM req CROSS JOIN tiles AS t '
+              'ON t.zoom_level=? AND t.tile_column=req.c AND t.tile_row=req.r')
+_SQL_TILE_ROWID = 'SELECT rowid FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?'
+_SQL_GRID = 'SELECT grid FROM grids WHERE zoom_level=? AND tile_column=? AND tile_row=?'
+_SQL_GRID_DATA = ('SELECT key_name, key_json FROM grid_data '
+                  'WHERE zoom_level=? AND tile_column=? AND tile_row=?')
+_SQL_COVERAGE_XMIN = 'SELECT MIN(tile_column) FROM tiles WHERE zoom_level=?'
+_SQL_COVERAGE_XMAX = ('SELECT tile_column FROM tiles AS t WHERE zoom_level=? AND NOT EXISTS '
+                      '(SELECT 1 FROM tiles WHERE zoom_level=t.zoom_level AND tile_column=t.tile_column + 1) '
+                      'ORDER BY tile_column LIMIT 1')
+_SQL_COVERAGE_Y = ('SELECT (SELECT MIN(tile_row) FROM tiles WHERE zoom_level=? AND tile_column=?), '
+                   '(SELECT MAX(tile_row) FROM tiles WHERE zoom_level=? AND tile_column=?)')
+
+
+@lru_cache(maxsize=4)
+def _tiles_query(count):
+    """ Query of `count` tiles at a same zoom level """
+    return _SQL_TILES % ','.join(['(?,?)'] * count)
+
+
+@lru_cache(maxsize=32)
+def _projection(tilesize, zoom):
+    """ Shared projection for tiles of `tilesize` at `zoom` """
+    return GoogleProjection(tilesize, [zoom])
+
+
 class ExtractionError(Exception):
     """ Raised when extraction of tiles from specified MBTiles has failed """
     pass
@@ -42,6 +102,108 @@ class DownloadError(Exception):
     pass
 
 
+class _ConnectionPool(object):
+    """
+    Keeps idle read-only SQLite connections per MBTiles file, so that
+    successive readers of the same file reuse open handles and warm page cache.
+    """
+    PRAGMAS = (
+        'PRAGMA cache_size=-262144',
+        'PRAGMA mmap_size=1073741824',
+        'PRAGMA temp_store=MEMORY',
+    )
+
+    def __init__(self, size=8):
+        self.size = size
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def _signature(self, filename):
+        # A file replaced on disk must not be served by connections to the old one
+        st = os.stat(filename)
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _queue(self, filename, signature):
+        with self._lock:
+            current = self._queues.get(filename)
+            if current is None or current[0] != signature:
+                if current is not None:
+                    self._drain(current[1])
+                current = (signature, queue.Queue(self.size))
+                self._queues[filename] = current
+            return current[1]
+
+    def _drain(self, idle):
+        while True:
+            try:
+                idle.get_nowait()[0].close()
+            except queue.Empty:
+                break
+
+    def _connect(self, filename):
+        uri = 'file:%s?mode=ro' % quote(filename)
+        con = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                              cached_statements=256)
+        for pragma in self.PRAGMAS:
+            con.execute(pragma)
+        return con
+
+    def acquire(self, filename):
+        """ Returns an idle (or new) connection to `filename`, with its signature """
+        filename = os.path.abspath(filename)
+        signature = self._signature(filename)
+        try:
+            con = self._queue(filename, signature).get_nowait()[0]
+        except queue.Empty:
+            con = self._connect(filename)
+        return con, signature
+
+    def release(self, filename, con, signature):
+        """ Gives back `con`, or closes it if pool is full or file has changed """
+        filename = os.path.abspath(filename)
+        with self._lock:
+            current = self._queues.get(filename)
+        if current is None or current[0] != signature:
+            con.close()
+            return
+        try:
+            current[1].put_nowait((con, signature))
+        except queue.Full:
+            con.close()
+
+    def clear(self):
+        with self._lock:
+            for signature, idle in self._queues.values():
+                self._drain(idle)
+            self._queues.clear()
+
+
+_connections = _ConnectionPool()
+
+
+_URL_KEYWORDS = ('s', 'x', 'y', 'z', 'size')
+
+
+def _compile_url(url):
+    """
+    Checks the tiles `url` keywords once, and returns a function rendering
+    it from their values (s, x, y, z, size)
+    """
+    for (literal, name, spec, conversion) in string.Formatter().parse(url):
+        if name is not None and name not in _URL_KEYWORDS:
+            def unknown(*values):
+                raise DownloadError(_("Unknown keyword %s in URL") % repr(name))
+            return unknown
+    return lambda *values: url.format_map(dict(zip(_URL_KEYWORDS, values)))
+
+
+class _Retry(Retry):
+    """ Retries policy which never waits longer than DOWNLOAD_RETRY_AFTER_MAX """
+    def parse_retry_after(self, retry_after):
+        seconds = super(_Retry, self).parse_retry_after(retry_after)
+        return min(seconds, DOWNLOAD_RETRY_AFTER_MAX)
+
+
 class TileSource(object):
     def __init__(self, tilesize=None):
         if tilesize is None:
@@ -52,69 +214,148 @@ class TileSource(object):
     def tile(self, z, x, y):
         raise NotImplementedError
 
+    def tiles(self, z_x_y_list):
+        """
+        Yields tuples ((z, x, y), content) for each of the specified tiles
+        """
+        for (z, x, y) in z_x_y_list:
+            yield (z, x, y), self.tile(z, x, y)
+
+    def tile_to_file(self, z, x, y, output):
+        """
+        Writes the specified tile content to the `output` file path
+        """
+        content = self.tile(z, x, y)
+        with open(output, 'wb') as f:
+            f.write(content)
+
     def metadata(self):
         return dict()
 
 
 class MBTilesReader(TileSource):
+    # Number of tiles requested per query in batch extraction
+    BATCH_SIZE = 400
+
     def __init__(self, filename, tilesize=None):
         super(MBTilesReader, self).__init__(tilesize)
         self.filename = filename
         self.basename = os.path.basename(self.filename)
         self._con = None
         self._cur = None
+        self._signature = None
+        # Contents of a MBTiles file do not change while it is read
+        self._metadata = None
+        self._zoomlevels = None
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """ Returns the connection to the pool of opened MBTiles files """
+        if self._con:
+            _connections.release(self.filename, self._con, self._signature)
+            self._con = None
+            self._cur = None
 
     def _query(self, sql, *args):
         """ Executes the specified `sql` query and returns the cursor """
-        if not self._con:
-            logger.debug(_("Open MBTiles file '%s'") % self.filename)
-            self._con = sqlite3.connect(self.filename)
-            self._cur = self._con.cursor()
-        sql = ' '.join(sql.split())
-        logger.debug(_("Execute query '%s' %s") % (sql, args))
         try:
+            if not self._con:
+                logger.debug(_("Open MBTiles file '%s'") % self.filename)
+                self._con, self._signature = _connections.acquire(self.filename)
+                self._cur = self._con.cursor()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(_("Execute query '%s' %s") % (sql, args))
             self._cur.execute(sql, *args)
-        except (sqlite3.OperationalError, sqlite3.DatabaseError)as e:
+        except (OSError, sqlite3.OperationalError, sqlite3.DatabaseError)as e:
             raise InvalidFormatError(_("%s while reading %s") % (e, self.filename))
         return self._cur
 
     def metadata(self):
-        rows = self._query('SELECT name, value FROM metadata')
-        rows = [(row[0], row[1]) for row in rows]
-        return dict(rows)
+        if self._metadata is None:
+            rows = self._query(_SQL_META)
+            self._metadata = dict((row[0], row[1]) for row in rows)
+        return dict(self._metadata)
 
     def zoomlevels(self):
-        rows = self._query('SELECT DISTINCT(zoom_level) FROM tiles ORDER BY zoom_level')
-        return [int(row[0]) for row in rows]
+        if self._zoomlevels is None:
+            rows = self._query(_SQL_ZOOM)
+            self._zoomlevels = [int(row[0]) for row in rows]
+        return list(self._zoomlevels)
 
     def tile(self, z, x, y):
-        logger.debug(_("Extract tile %s") % ((z, x, y),))
-        tms_y = flip_y(int(y), int(z))
-        rows = self._query('''SELECT tile_data FROM tiles
-                              WHERE zoom_level=? AND tile_column=? AND tile_row=?;''', (z, x, tms_y))
-        t = rows.fetchone()
-        if not t:
-            raise ExtractionError(_("Could not extract tile %s from %s") % ((z, x, y), self.filename))
-        return t[0]
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(_("Extract tile %s") % ((z, x, y),))
+        for (z_x_y, content) in self.tiles([(z, x, y)]):
+            return content
 
-    def grid(self, z, x, y, callback=None):
-        tms_y = flip_y(int(y), int(z))
-        rows = self._query('''SELECT grid FROM grids
-                              WHERE zoom_level=? AND tile_column=? AND tile_row=?;''', (z, x, tms_y))
+    def tiles(self, z_x_y_list):
+        """
+        Extract the specified tiles with one query per zoom level and per
+        chunk of BATCH_SIZE tiles. Tiles are yielded in index order, i.e.
+        sorted by zoom level, column and row.
+        """
+        byzoom = {}
+        for (z, x, y) in z_x_y_list:
+            z, x, y = int(z), int(x), int(y)
+            byzoom.setdefault(z, {})[(x, flip_y(y, z))] = (z, x, y)
+
+        for z in sorted(byzoom):
+            requested = byzoom[z]
+            keys = sorted(requested)
+            for i in range(0, len(keys), self.BATCH_SIZE):
+                chunk = keys[i:i + self.BATCH_SIZE]
+                args = []
+                for key in chunk:
+                    args.extend(key)
+                args.append(z)
+                rows = self._query(_tiles_query(len(chunk)), args)
+                found = dict(((col, row), data) for (col, row, data) in rows)
+                for key in chunk:
+                    if key not in found:
+                        raise ExtractionError(_("Could not extract tile %s from %s") % (requested[key], self.filename))
+                    yield requested[key], found[key]
+
+    def tile_to_file(self, z, x, y, output):
+        """
+        Streams the specified tile content to the `output` file path,
+        without loading it entirely in memory.
+        """
+        z, x = int(z), int(x)
+        # ``tiles`` can be a view (e.g. deduplicated images), without rowid
+        # nor incremental I/O
+        try:
+            rows = self._query(_SQL_TILE_ROWID, (z, x, flip_y(int(y), z)))
+        except InvalidFormatError:
+            rows = None
+        t = rows and rows.fetchone()
+        if t is None or t[0] is None:
+            return super(MBTilesReader, self).tile_to_file(z, x, y, output)
+        blob = self._con.blobopen('tiles', 'tile_data', t[0], readonly=True)
+        with blob, open(output, 'wb') as f:
+            shutil.copyfileobj(blob, f, 1 << 16)
+
+    def grid_raw(self, z, x, y):
+        """
+        Returns the grid of the specified tile as stored in the MBTiles file :
+        its zlib-compressed blob, and its data as JSON strings by key.
+        """
+        z, x = int(z), int(x)
+        tms_y = flip_y(int(y), z)
+        rows = self._query(_SQL_GRID, (z, x, tms_y))
         t = rows.fetchone()
         if not t:
             raise ExtractionError(_("Could not extract grid %s from %s") % ((z, x, y), self.filename))
-        grid_json = json.loads(zlib.decompress(t[0]))
+        rows = self._query(_SQL_GRID_DATA, (z, x, tms_y))
+        return t[0], dict(rows)
 
-        rows = self._query('''SELECT key_name, key_json FROM grid_data
-                              WHERE zoom_level=? AND tile_column=? AND tile_row=?;''', (z, x, tms_y))
+    def grid(self, z, x, y, callback=None):
+        blob, data = self.grid_raw(z, x, y)
+        grid_json = _loads(zlib.decompress(blob))
         # join up with the grid 'data' which is in pieces when stored in mbtiles file
-        grid_json['data'] = {}
-        grid_data = rows.fetchone()
-        while grid_data:
-            grid_json['data'][grid_data[0]] = json.loads(grid_data[1])
-            grid_data = rows.fetchone()
-        serialized = json.dumps(grid_json)
+        grid_json['data'] = {key: _loads(value) for (key, value) in data.items()}
+        serialized = _dumps(grid_json)
         if callback is not None:
             return '%s(%s);' % (callback, serialized)
         return serialized
@@ -124,70 +365,178 @@ class MBTilesReader(TileSource):
         Returns the bounding box (minx, miny, maxx, maxy) of an adjacent
         group of tiles at this zoom level.
         """
-        # Find a group of adjacent available tiles at this zoom level
-        rows = self._query('''SELECT tile_column, tile_row FROM tiles
-                              WHERE zoom_level=?
-                              ORDER BY tile_column, tile_row;''', (zoom,))
-        t = rows.fetchone()
-        xmin, ymin = t
-        previous = t
-        while t and t[0] - previous[0] <= 1:
-            # adjacent, go on
-            previous = t
-            t = rows.fetchone()
-        xmax, ymax = previous
+        # Find a group of adjacent available tiles at this zoom level :
+        # from the first column, up to the first one not followed by another
+        rows = self._query(_SQL_COVERAGE_XMIN, (zoom,))
+        xmin = rows.fetchone()[0]
+        if xmin is None:
+            raise ExtractionError(_("No tiles at zoom level %s in %s") % (zoom, self.filename))
+        rows = self._query(_SQL_COVERAGE_XMAX, (zoom,))
+        xmax = rows.fetchone()[0]
+        rows = self._query(_SQL_COVERAGE_Y, (zoom, xmin, zoom, xmax))
+        ymin, ymax = rows.fetchone()
         # Transform (xmin, ymin) (xmax, ymax) to pixels
         S = self.tilesize
         bottomleft = (xmin * S, (ymax + 1) * S)
         topright = ((xmax + 1) * S, ymin * S)
         # Convert center to (lon, lat)
-        proj = GoogleProjection(S, [zoom])  # WGS84
+        proj = _projection(S, zoom)  # WGS84
         return proj.unproject_pixels(bottomleft, zoom) + proj.unproject_pixels(topright, zoom)
 
 
 class TileDownloader(TileSource):
-    def __init__(self, url, headers=None, subdomains=None, tilesize=None):
+    # Prefetches are opportunistic: no retries, and a short timeout
+    PREFETCH_TIMEOUT = 5
+
+    def __init__(self, url, headers=None, subdomains=None, tilesize=None, cache=None):
         super(TileDownloader, self).__init__(tilesize)
         self.tiles_url = url
         self.tiles_subdomains = subdomains or ['a', 'b', 'c']
         parsed = urlparse(self.tiles_url)
         self.basename = parsed.netloc+parsed.path
         self.headers = headers or {}
+        self.cache = cache
+        self._render_url = _compile_url(self.tiles_url)
+        # Keep connections alive between tiles, one pool per subdomain.
+        # Back off exponentially on errors, and as told by servers on throttling,
+        # but give up quickly on unreachable servers
+        retries = _Retry(total=DOWNLOAD_RETRIES, connect=DOWNLOAD_CONNECT_RETRIES,
+                         status=DOWNLOAD_RETRIES, status_forcelist=[429, 500, 502, 503, 504],
+                         backoff_factor=0.5, backoff_max=DOWNLOAD_BACKOFF_MAX,
+                         respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=len(self.tiles_subdomains),
+                              pool_maxsize=32, max_retries=retries)
+        self._session = requests.Session()
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        # Background downloads, most relevant first
+        self._prefetching = queue.PriorityQueue()
+        self._prefetched = itertools.count()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._prefetcher = None
+        self._prefetch_session = None
+
+    def tile_url(self, z, x, y):
+        """
+        Render each keyword in URL ({s}, {x}, {y}, {z}, {size} ... )
+        """
+        s = self.tiles_subdomains[(x + y) % len(self.tiles_subdomains)]
+        return self._render_url(s, x, y, z, self.tilesize)
 
     def tile(self, z, x, y):
         """
         Download the specified tile from `tiles_url`
         """
         logger.debug(_("Download tile %s") % ((z, x, y),))
-        # Render each keyword in URL ({s}, {x}, {y}, {z}, {size} ... )
-        size = self.tilesize
-        s = self.tiles_subdomains[(x + y) % len(self.tiles_subdomains)];
-        try:
-            url = self.tiles_url.format(**locals())
-        except KeyError as e:
-            raise DownloadError(_("Unknown keyword %s in URL") % e)
+        return self._download(self.tile_url(z, x, y), self._session)
+
+    def _download(self, url, session, timeout=None):
+        if self.cache is not None:
+            content = self.cache.read(url)
+            if content is not None:
+                return content
 
         logger.debug(_("Retrieve tile at %s") % url)
-        r = DOWNLOAD_RETRIES
-        sleeptime = 1
-        while r > 0:
+        try:
+            r = session.get(url, headers=self.headers, timeout=timeout)
+            r.raise_for_status()
+        except requests.RequestException as e:
+            raise DownloadError(_("Cannot download URL %s (%s)") % (url, e))
+        if self.cache is not None:
+            self.cache.save(r.content, url)
+        return r.content
+
+    def tiles(self, z_x_y_list, max_workers=8):
+        """
+        Download the specified tiles in parallel, using `max_workers` threads.
+        Tiles are yielded in the requested order.
+        """
+        def download(z_x_y):
+            (z, x, y) = z_x_y
+            return (z, x, y), self.tile(z, x, y)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for result in executor.map(download, z_x_y_list):
+                yield result
+
+    def prefetch(self, z, x, y, radius=1):
+        """
+        Download in background, into the download cache, the tiles around the
+        specified one within `radius`, as well as its parent and children.
+        Tiles at the same zoom level are fetched first.
+        """
+        assert self.cache is not None, _("Cannot prefetch tiles without download cache")
+        if self._prefetcher is None:
+            # Interpreter exit waits for executors jobs, before running atexit
+            # callbacks: stop prefetching from the same (earlier) hook.
+            close = weakref.WeakMethod(self.close)
             try:
-                request = urllib.request.Request(url)
-                for header, value in self.headers.items():
-                    request.add_header(header, value)
-                stream = urllib.request.urlopen(request)
-                print(stream.getcode())
-                assert stream.getcode() == 200
-                return stream.read()
-            except (AssertionError, IOError)as e:
-                print(e)
-                logger.debug(_("Download error, retry (%s left). (%s)") % (r, e))
-                r -= 1
-                time.sleep(sleeptime)
-                # progressivly sleep longer to wait for this tile
-                if (sleeptime <= 10) and (r % 2 == 0):
-                    sleeptime += 1  # increase wait
-        raise DownloadError(_("Cannot download URL %s") % url)
+                threading._register_atexit(lambda: close() and close()())
+            except RuntimeError:
+                # Interpreter is shutting down, prefetching is pointless
+                return
+            self._prefetcher = ThreadPoolExecutor(max_workers=4)
+            self._prefetch_session = requests.Session()
+        for (priority, z_x_y) in self._around(z, x, y, radius):
+            url = self.tile_url(*z_x_y)
+            with self._pending_lock:
+                if url in self._pending:
+                    continue
+                self._pending.add(url)
+            if self.cache.exists(url):
+                self._discard(url)
+                continue
+            self._prefetching.put((priority, next(self._prefetched), url))
+            self._prefetcher.submit(self._prefetch_next, self._prefetching,
+                                    self._prefetch_session)
+
+    def close(self, wait=False):
+        """
+        Stops background prefetching. Pending prefetches are cancelled,
+        unless `wait` is True.
+        """
+        if self._prefetcher is not None:
+            self._prefetcher.shutdown(wait=wait, cancel_futures=not wait)
+            self._prefetcher = None
+            # Jobs still running keep the previous queue and session
+            (prefetching, self._prefetching) = (self._prefetching, queue.PriorityQueue())
+            while True:
+                try:
+                    self._discard(prefetching.get_nowait()[-1])
+                except queue.Empty:
+                    break
+            self._prefetch_session.close()
+
+    def _around(self, z, x, y, radius):
+        around = set()
+        n = 1 << z
+        for dx in range(-radius, radius + 1):
+            for dy in range(-radius, radius + 1):
+                if (dx or dy) and 0 <= y + dy < n:
+                    around.add((10, (z, (x + dx) % n, y + dy)))
+        if z > 0:
+            around.add((11, (z - 1, x // 2, y // 2)))
+        for (cx, cy) in ((0, 0), (0, 1), (1, 0), (1, 1)):
+            around.add((11, (z + 1, 2 * x + cx, 2 * y + cy)))
+        return sorted(around)
+
+    def _prefetch_next(self, prefetching, session):
+        try:
+            (priority, count, url) = prefetching.get_nowait()
+        except queue.Empty:
+            # Drained by close()
+            return
+        try:
+            self._download(url, session, timeout=self.PREFETCH_TIMEOUT)
+        except DownloadError as e:
+            logger.debug(_("Could not prefetch tile %s (%s)") % (url, e))
+        finally:
+            self._discard(url)
+
+    def _discard(self, url):
+        with self._pending_lock:
+            self._pending.discard(url)
 
 
 class WMSReader(TileSource):
@@ -210,31 +559,56 @@ class WMSReader(TileSource):
         )
         self.wmsParams.update(**kwargs)
         projectionKey = 'srs'
-        if parse_version(self.wmsParams['version']) >= parse_version('1.3'):
+        version = tuple(int(n) for n in self.wmsParams['version'].split('.'))
+        if version >= (1, 3):
             projectionKey = 'crs'
         self.wmsParams[projectionKey] = GoogleProjection.NAME
+        self._session = requests.Session()
+
+    def _bboxes(self, z_x_y_list):
+        """
+        Returns the WMS bbox parameter of each tile, projecting all corners at once
+        """
+        corners = []
+        for (z, x, y) in z_x_y_list:
+            bbox = _projection(self.tilesize, z).tile_bbox((z, x, y))
+            corners.append(bbox[:2])
+            corners.append(bbox[2:])
+        corners = GoogleProjection.project_batch(corners)
+        return [','.join(map(str, corners[i] + corners[i + 1]))
+                for i in range(0, len(corners), 2)]
 
     def tile(self, z, x, y):
         logger.debug(_("Request WMS tile %s") % ((z, x, y),))
-        proj = GoogleProjection(self.tilesize, [z])
+        proj = _projection(self.tilesize, z)
         bbox = proj.tile_bbox((z, x, y))
         bbox = proj.project(bbox[:2]) + proj.project(bbox[2:])
-        bbox = ','.join(map(str, bbox))
-        # Build WMS request URL
-        encodedparams = urllib.urlencode(self.wmsParams)
-        url = "%s?%s" % (self.url, encodedparams)
-        url += "&bbox=%s" % bbox   # commas are not encoded
+        return self._request((z, x, y), ','.join(map(str, bbox)))
+
+    def tiles(self, z_x_y_list, max_workers=8):
+        """
+        Request the specified tiles in parallel, using `max_workers` threads.
+        Tiles are yielded in the requested order.
+        """
+        z_x_y_list = list(z_x_y_list)
+        bboxes = self._bboxes(z_x_y_list)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for (z_x_y, content) in zip(z_x_y_list, executor.map(self._request, z_x_y_list, bboxes)):
+                yield z_x_y, content
+
+    def _request(self, z_x_y, bbox):
+        (z, x, y) = z_x_y
+        params = dict(self.wmsParams, bbox=bbox)
         try:
-            logger.debug(_("Download '%s'") % url)
-            request = urllib2.Request(url)
-            for header, value in self.headers.items():
-                request.add_header(header, value)
-            f = urllib2.urlopen(request)
-            header = f.info().typeheader
-            assert header == self.wmsParams['format'], "Invalid WMS response type : %s" % header
-            return f.read()
-        except (AssertionError, IOError):
-            raise ExtractionError
+            logger.debug(_("Download '%s' with %s") % (self.url, params))
+            r = self._session.get(self.url, params=params, headers=self.headers)
+            r.raise_for_status()
+        except requests.RequestException as e:
+            raise ExtractionError(_("Cannot request WMS tile %s (%s)") % ((z, x, y), e))
+        header = r.headers.get('Content-Type', '').split(';')[0]
+        if header != self.wmsParams['format']:
+            raise ExtractionError(_("Invalid WMS response type : %s") % header)
+        return r.content
 
 
 class MapnikRenderer(TileSource):
@@ -245,13 +619,15 @@ class MapnikRenderer(TileSource):
         self.basename = os.path.basename(self.stylefile)
         self._mapnik = None
         self._prj = None
+        self._img = None
+        self._img_size = None
 
     def tile(self, z, x, y):
         """
         Render the specified tile with Mapnik
         """
         logger.debug(_("Render tile %s") % ((z, x, y),))
-        proj = GoogleProjection(self.tilesize, [z])
+        proj = _projection(self.tilesize, z)
         return self.render(proj.tile_bbox((z, x, y)))
 
     def _prepare_rendering(self, bbox, width=None, height=None):
@@ -259,6 +635,7 @@ class MapnikRenderer(TileSource):
             self._mapnik = mapnik.Map(width, height)
             # Load style XML
             mapnik.load_map(self._mapnik, self.stylefile, True)
+            self._mapnik.buffer_size = 128
             # Obtain <Map> projection
             self._prj = mapnik.Projection(self._mapnik.srs)
 
@@ -269,9 +646,9 @@ class MapnikRenderer(TileSource):
 
         # Bounding box for the tile
         bbox = mapnik.Box2d(c0.x, c0.y, c1.x, c1.y)
-        self._mapnik.resize(width, height)
+        if (self._mapnik.width, self._mapnik.height) != (width, height):
+            self._mapnik.resize(width, height)
         self._mapnik.zoom_to_box(bbox)
-        self._mapnik.buffer_size = 128
 
     def render(self, bbox, width=None, height=None):
         """
@@ -282,21 +659,21 @@ class MapnikRenderer(TileSource):
         self._prepare_rendering(bbox, width=width, height=height)
 
         # Render image with default Agg renderer
-        tmpfile = NamedTemporaryFile(delete=False)
-        im = mapnik.Image(width, height)
+        if self._img_size != (width, height):
+            self._img = mapnik.Image(width, height)
+            self._img_size = (width, height)
+        else:
+            self._img.clear()
+        im = self._img
         mapnik.render(self._mapnik, im)
-        im.save(tmpfile.name, 'png256')  # TODO: mapnik output only to file?
-        tmpfile.close()
-        content = open(tmpfile.name).read()
-        os.unlink(tmpfile.name)
-        return content
+        return im.tostring('png256')
 
     def grid(self, z, x, y, fields, layer):
         """
         Render the specified grid with Mapnik
         """
         logger.debug(_("Render grid %s") % ((z, x, y),))
-        proj = GoogleProjection(self.tilesize, [z])
+        proj = _projection(self.tilesize, z)
         return self.render_grid(proj.tile_bbox((z, x, y)), fields, layer)
 
     def render_grid(self, bbox, grid_fields, layer, width=None, height=None):
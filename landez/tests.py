@@ -1,16 +1,22 @@
 import os
+import time
 import logging
 import unittest
 import shutil
 import tempfile
 import json
+import zlib
 import sqlite3
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
 
 from .tiles import (TilesManager, MBTilesBuilder, ImageExporter,
                    EmptyCoverageError, DownloadError)
-from .proj import InvalidCoverageError
-from .cache import Disk
-from .sources import MBTilesReader
+from .proj import GoogleProjection, InvalidCoverageError
+from .cache import Disk, DownloadCache
+from . import DOWNLOAD_RETRY_AFTER_MAX
+from .sources import (MBTilesReader, TileDownloader, WMSReader,
+                      ExtractionError, InvalidFormatError, _Retry, _tiles_query)
 
 
 class TestTilesManager(unittest.TestCase):
@@ -106,6 +112,174 @@ class TestTilesManager(unittest.TestCase):
         self.assertRaises(DownloadError, mb.tile, (10, 1, 2))
 
 
+class TileHandler(BaseHTTPRequestHandler):
+    """ Serves the requested path as tile content, except for missing tiles """
+    throttled = set()
+    requested = []
+
+    def do_GET(self):
+        self.requested.append(self.path)
+        if 'missing' in self.path:
+            self.send_error(404)
+            return
+        if 'throttled' in self.path and self.path not in self.throttled:
+            self.throttled.add(self.path)
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = self.path.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestTileDownloader(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), TileHandler)
+        cls.url = 'http://127.0.0.1:%s' % cls.server.server_port
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_tile(self):
+        downloader = TileDownloader(self.url + '/{z}/{x}/{y}.png')
+        self.assertEqual(downloader.tile(1, 0, 1), b'/1/0/1.png')
+        downloader = TileDownloader(self.url + '/missing/{z}/{x}/{y}.png')
+        self.assertRaises(DownloadError, downloader.tile, 1, 0, 1)
+
+    def test_retry_after_is_bounded(self):
+        retries = _Retry(total=3)
+        self.assertEqual(retries.parse_retry_after('2'), 2)
+        self.assertEqual(retries.parse_retry_after('3600'), DOWNLOAD_RETRY_AFTER_MAX)
+        # Copies made at each retry keep the bound
+        self.assertEqual(retries.increment().parse_retry_after('3600'), DOWNLOAD_RETRY_AFTER_MAX)
+
+    def test_tile_unreachable(self):
+        downloader = TileDownloader('http://127.0.0.1:1/{z}/{x}/{y}.png')
+        start = time.time()
+        self.assertRaises(DownloadError, downloader.tile, 1, 0, 1)
+        self.assertTrue(time.time() - start < 10)
+
+    def test_tile_url(self):
+        downloader = TileDownloader('http://{s}.server/{z:02d}/{x}/{y}@{size}.png',
+                                    subdomains=['a', 'b'])
+        self.assertEqual(downloader.tile_url(3, 1, 2), 'http://b.server/03/1/2@256.png')
+        downloader = TileDownloader('http://server/{z!s}/{x}/{y}.png')
+        self.assertEqual(downloader.tile_url(3, 1, 2), 'http://server/3/1/2.png')
+        downloader = TileDownloader('http://{X}.server/{z}/{x}/{y}.png')
+        self.assertRaises(DownloadError, downloader.tile_url, 3, 1, 2)
+        downloader = TileDownloader('http://server/{z!s}/{X}/{y}.png')
+        self.assertRaises(DownloadError, downloader.tile_url, 3, 1, 2)
+
+    def test_tile_throttled(self):
+        downloader = TileDownloader(self.url + '/throttled/{z}/{x}/{y}.png')
+        start = time.time()
+        self.assertEqual(downloader.tile(1, 0, 1), b'/throttled/1/0/1.png')
+        self.assertTrue(time.time() - start >= 1)
+
+    def test_tile_cached(self):
+        cache = DownloadCache(os.path.join(tempfile.gettempdir(), 'landez-downloads.db'))
+        downloader = TileDownloader(self.url + '/{z}/{x}/{y}.png', cache=cache)
+        self.assertEqual(downloader.tile(1, 0, 1), b'/1/0/1.png')
+        self.assertTrue(cache.exists(self.url + '/1/0/1.png'))
+        # Served from cache, even if server is unreachable
+        downloader = TileDownloader('http://127.0.0.1:1/{z}/{x}/{y}.png', cache=cache)
+        cache.save(b'cached', 'http://127.0.0.1:1/1/0/1.png')
+        self.assertEqual(downloader.tile(1, 0, 1), b'cached')
+        cache.clean()
+
+    def test_prefetch(self):
+        cache = DownloadCache(os.path.join(tempfile.gettempdir(), 'landez-downloads.db'))
+        downloader = TileDownloader(self.url + '/{z}/{x}/{y}.png', cache=cache)
+        downloader.prefetch(1, 0, 0)
+        downloader.close(wait=True)
+        for (z, x, y) in [(1, 1, 0), (1, 1, 1), (1, 0, 1), (0, 0, 0), (2, 1, 1)]:
+            self.assertTrue(cache.exists(self.url + '/%s/%s/%s.png' % (z, x, y)))
+        self.assertFalse(cache.exists(self.url + '/1/0/0.png'))
+        cache.clean()
+        self.assertRaises(AssertionError, TileDownloader(self.url).prefetch, 1, 0, 0)
+
+    def test_prefetch_close(self):
+        cache = DownloadCache(os.path.join(tempfile.gettempdir(), 'landez-downloads.db'))
+        downloader = TileDownloader('http://127.0.0.1:1/{z}/{x}/{y}.png', cache=cache)
+        start = time.time()
+        downloader.prefetch(3, 2, 2)
+        downloader.close()
+        self.assertTrue(time.time() - start < 5)
+        # Unreachable tiles were not retried
+        downloader.prefetch(3, 2, 2)
+        downloader.close(wait=True)
+        self.assertTrue(time.time() - start < 5)
+        cache.clean()
+
+    def test_prefetch_again(self):
+        cache = DownloadCache(os.path.join(tempfile.gettempdir(), 'landez-downloads.db'))
+        cache.clean()
+        downloader = TileDownloader(self.url + '/again/{z}/{x}/{y}.png', cache=cache)
+        del TileHandler.requested[:]
+        # Overlapping tiles are downloaded once
+        downloader.prefetch(2, 1, 1)
+        downloader.prefetch(2, 2, 1)
+        downloader.close(wait=True)
+        self.assertEqual(len(TileHandler.requested), len(set(TileHandler.requested)))
+        # Tiles requested after close are still prefetched
+        downloader.prefetch(4, 5, 5)
+        downloader.close()
+        downloader.prefetch(3, 6, 6)
+        downloader.close(wait=True)
+        for (z, x, y) in [(3, 5, 5), (3, 7, 7), (2, 3, 3), (4, 13, 13)]:
+            self.assertTrue(cache.exists(self.url + '/again/%s/%s/%s.png' % (z, x, y)))
+        cache.clean()
+
+    def test_tiles(self):
+        downloader = TileDownloader(self.url + '/{z}/{x}/{y}.png')
+        tiles = list(downloader.tiles([(1, 0, 1), (1, 1, 0), (2, 3, 1)]))
+        self.assertEqual(tiles, [((1, 0, 1), b'/1/0/1.png'),
+                                 ((1, 1, 0), b'/1/1/0.png'),
+                                 ((2, 3, 1), b'/2/3/1.png')])
+
+
+class TestWMSReader(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), TileHandler)
+        cls.url = 'http://127.0.0.1:%s/wms' % cls.server.server_port
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_tile(self):
+        reader = WMSReader(self.url, ['roads', 'rivers'])
+        content = reader.tile(0, 0, 0).decode()
+        self.assertTrue(content.startswith('/wms?'))
+        self.assertTrue('layers=roads%2Crivers' in content)
+        self.assertTrue('bbox=' in content)
+        # Response type does not match requested format
+        reader = WMSReader(self.url, ['roads'], format='image/jpeg')
+        self.assertRaises(ExtractionError, reader.tile, 0, 0, 0)
+
+    def test_tiles(self):
+        reader = WMSReader(self.url, ['roads'])
+        tiles = list(reader.tiles([(1, 0, 0), (1, 1, 1)]))
+        self.assertEqual([z_x_y for (z_x_y, content) in tiles], [(1, 0, 0), (1, 1, 1)])
+        for (z_x_y, content) in tiles:
+            self.assertEqual(content, reader.tile(*z_x_y))
+
+
 class TestMBTilesBuilder(unittest.TestCase):
     temp_cache = os.path.join(tempfile.gettempdir(), 'landez/stileopenstreetmaporg_z_x_ypng')
     temp_dir = os.path.join(tempfile.gettempdir(), 'landez/tiles')
@@ -206,6 +380,165 @@ class TestMBTilesBuilder(unittest.TestCase):
         self.assertEqual(mb.zoomlevels[4], 12)
 
 
+class TestMBTilesReader(unittest.TestCase):
+    filepath = os.path.join(tempfile.gettempdir(), 'landez-reader.mbtiles')
+
+    def setUp(self):
+        con = sqlite3.connect(self.filepath)
+        con.executescript('''
+            CREATE TABLE metadata (name text, value text);
+            CREATE TABLE tiles (zoom_level integer, tile_column integer,
+                                tile_row integer, tile_data blob);
+            CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+            CREATE TABLE grids (zoom_level integer, tile_column integer,
+                                tile_row integer, grid blob);
+            CREATE TABLE grid_data (zoom_level integer, tile_column integer,
+                                    tile_row integer, key_name text, key_json text);
+        ''')
+        con.executemany('INSERT INTO metadata VALUES (?, ?)',
+                        [('name', 'test'), ('format', 'png')])
+        # Columns 0-1 are adjacent at zoom 2, column 3 is isolated
+        tiles = [(1, 0, 0), (1, 1, 1), (2, 0, 1), (2, 1, 2), (2, 3, 0)]
+        con.executemany('INSERT INTO tiles VALUES (?, ?, ?, ?)',
+                        [(z, x, y, ('%s/%s/%s' % (z, x, y)).encode()) for (z, x, y) in tiles])
+        grid = {'grid': [' !'], 'keys': ['', '39']}
+        con.execute('INSERT INTO grids VALUES (1, 0, 0, ?)',
+                    (zlib.compress(json.dumps(grid).encode()),))
+        con.execute('INSERT INTO grid_data VALUES (1, 0, 0, ?, ?)',
+                    ('39', json.dumps({'NAME': 'Costa Rica'})))
+        con.commit()
+        con.close()
+
+    def tearDown(self):
+        os.remove(self.filepath)
+
+    def test_tile(self):
+        reader = MBTilesReader(self.filepath)
+        # Y is flipped from XYZ to TMS
+        self.assertEqual(reader.tile(1, 0, 1), b'1/0/0')
+        self.assertRaises(ExtractionError, reader.tile, 1, 0, 0)
+
+    def test_tiles(self):
+        reader = MBTilesReader(self.filepath)
+        tiles = list(reader.tiles([(2, 3, 3), (1, 1, 0), (2, 0, 2)]))
+        self.assertEqual(tiles, [((1, 1, 0), b'1/1/1'),
+                                 ((2, 0, 2), b'2/0/1'),
+                                 ((2, 3, 3), b'2/3/0')])
+        self.assertRaises(ExtractionError, list, reader.tiles([(1, 1, 0), (2, 2, 2)]))
+
+    def test_tile_to_file(self):
+        reader = MBTilesReader(self.filepath)
+        output = os.path.join(tempfile.gettempdir(), 'landez-tile.png')
+        reader.tile_to_file(2, 0, 2, output)
+        with open(output, 'rb') as f:
+            self.assertEqual(f.read(), b'2/0/1')
+        self.assertRaises(ExtractionError, reader.tile_to_file, 2, 2, 2, output)
+        # Tiles stored as a view over images
+        con = sqlite3.connect(self.filepath)
+        con.executescript('''
+            ALTER TABLE tiles RENAME TO images;
+            CREATE VIEW tiles AS SELECT * FROM images;
+        ''')
+        con.close()
+        reader = MBTilesReader(self.filepath)
+        reader.tile_to_file(2, 0, 2, output)
+        with open(output, 'rb') as f:
+            self.assertEqual(f.read(), b'2/0/1')
+        os.remove(output)
+
+    def test_tiles_query_plan(self):
+        # Each requested tile is looked up in the index, whatever the file size
+        con = sqlite3.connect(self.filepath)
+        plan = con.execute('EXPLAIN QUERY PLAN ' + _tiles_query(MBTilesReader.BATCH_SIZE),
+                           [0] * (2 * MBTilesReader.BATCH_SIZE + 1)).fetchall()
+        con.close()
+        details = [row[-1] for row in plan]
+        self.assertTrue(any('tile_index (zoom_level=? AND tile_column=? AND tile_row=?)' in d
+                            for d in details), details)
+
+    def test_metadata(self):
+        reader = MBTilesReader(self.filepath)
+        self.assertEqual(reader.metadata(), {'name': 'test', 'format': 'png'})
+        self.assertEqual(reader.zoomlevels(), [1, 2])
+        # Results are kept, and not altered by callers
+        reader.metadata()['name'] = 'other'
+        con = sqlite3.connect(self.filepath)
+        con.execute("DELETE FROM metadata")
+        con.execute("DELETE FROM tiles WHERE zoom_level=1")
+        con.commit()
+        con.close()
+        self.assertEqual(reader.metadata(), {'name': 'test', 'format': 'png'})
+        self.assertEqual(reader.zoomlevels(), [1, 2])
+
+    def test_grid(self):
+        reader = MBTilesReader(self.filepath)
+        grid = json.loads(reader.grid(1, 0, 1))
+        self.assertEqual(grid['keys'], ['', '39'])
+        self.assertEqual(grid['data'], {'39': {'NAME': 'Costa Rica'}})
+        self.assertTrue('"data":{"39":{"NAME":"Costa Rica"}}' in reader.grid(1, 0, 1))
+        self.assertTrue(reader.grid(1, 0, 1, 'cb').startswith('cb('))
+        self.assertRaises(ExtractionError, reader.grid, 1, 1, 1)
+
+    def test_grid_raw(self):
+        reader = MBTilesReader(self.filepath)
+        blob, data = reader.grid_raw(1, 0, 1)
+        self.assertEqual(json.loads(zlib.decompress(blob))['keys'], ['', '39'])
+        self.assertEqual(data, {'39': '{"NAME": "Costa Rica"}'})
+
+    def test_find_coverage(self):
+        reader = MBTilesReader(self.filepath)
+        # Isolated column 3 is left out
+        self.assertEqual(reader.find_coverage(2),
+                         (-180.0, -66.51326044311185, 0.0, 66.51326044311185))
+        self.assertEqual(reader.find_coverage(1),
+                         (-180.0, -85.05112877980659, 180.0, 85.0511287798066))
+        self.assertRaises(ExtractionError, reader.find_coverage, 3)
+
+    def test_invalid_file(self):
+        reader = MBTilesReader(os.path.join(tempfile.gettempdir(), 'missing.mbtiles'))
+        self.assertRaises(InvalidFormatError, reader.metadata)
+
+    def test_connections_are_reused(self):
+        reader = MBTilesReader(self.filepath)
+        reader.metadata()
+        con = reader._con
+        reader.close()
+        other = MBTilesReader(self.filepath)
+        other.metadata()
+        self.assertTrue(other._con is con)
+        other.close()
+
+    def test_replaced_file_is_reopened(self):
+        reader = MBTilesReader(self.filepath)
+        self.assertEqual(reader.tile(1, 0, 1), b'1/0/0')
+        reader.close()
+        con = sqlite3.connect(self.filepath)
+        con.execute("UPDATE tiles SET tile_data=? WHERE zoom_level=1 AND tile_column=0",
+                    (b'updated!',))
+        con.commit()
+        con.close()
+        reader = MBTilesReader(self.filepath)
+        self.assertEqual(reader.tile(1, 0, 1), b'updated!')
+
+
+class TestGoogleProjection(unittest.TestCase):
+    def test_project_batch(self):
+        proj = GoogleProjection()
+        lng_lats = [(-180.0, -90.0), (1.44, 43.6), (180.0, 90.0)]
+        projected = GoogleProjection.project_batch(lng_lats)
+        for (lng_lat, (x, y)) in zip(lng_lats, projected):
+            self.assertAlmostEqual(x, proj.project(lng_lat)[0], places=6)
+            self.assertAlmostEqual(y, proj.project(lng_lat)[1], places=6)
+        # Without numpy
+        from . import proj as projmodule
+        has_numpy, projmodule.has_numpy = projmodule.has_numpy, False
+        try:
+            self.assertEqual(GoogleProjection.project_batch(lng_lats),
+                             [proj.project(lng_lat) for lng_lat in lng_lats])
+        finally:
+            projmodule.has_numpy = has_numpy
+
+
 class TestImageExporter(unittest.TestCase):
     def test_gridtiles(self):
         mb = ImageExporter()
@@ -252,6 +585,21 @@ class TestCache(unittest.TestCase):
         c.basename = 'bar'
         self.assertEqual(c.folder, '/tmp/bar')
 
+    def test_download_cache(self):
+        filename = os.path.join(tempfile.gettempdir(), 'landez-downloads.db')
+        c = DownloadCache(filename)
+        self.assertEqual(c.read('http://server/1.png'), None)
+        c.save(b'tile', 'http://server/1.png')
+        self.assertEqual(c.read('http://server/1.png'), b'tile')
+        c.remove('http://server/1.png')
+        self.assertFalse(c.exists('http://server/1.png'))
+        # Expired entries
+        c = DownloadCache(filename, ttl=-10)
+        c.save(b'tile', 'http://server/1.png')
+        self.assertEqual(c.read('http://server/1.png'), None)
+        c.clean()
+        self.assertFalse(os.path.exists(filename))
+
     def test_clean(self):
         mb = TilesManager()
         self.assertEqual(mb.cache.folder, self.temp_path)
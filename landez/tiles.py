@@ -14,21 +14,16 @@ from . import (DEFAULT_TILES_URL, DEFAULT_TILES_SUBDOMAINS,
                DEFAULT_TMP_DIR, DEFAULT_FILEPATH, DEFAULT_TILE_SIZE,
                DEFAULT_TILE_FORMAT, DEFAULT_TILE_SCHEME)
 from .proj import GoogleProjection
-from .cache import Disk, Dummy
+from .cache import Disk, Dummy, DownloadCache
 from .sources import (MBTilesReader, TileDownloader, WMSReader,
                      MapnikRenderer, ExtractionError, DownloadError)
 
 has_pil = False
 try:
-    import Image
-    import ImageEnhance
+    from PIL import Image, ImageEnhance
     has_pil = True
 except ImportError:
-    try:
-        from PIL import Image, ImageEnhance
-        has_pil = True
-    except ImportError:
-        pass
+    pass
 
 
 logger = logging.getLogger(__name__)
@@ -56,6 +51,8 @@ class TilesManager(object):
 
         tiles_url -- remote URL to download tiles (*default DEFAULT_TILES_URL*)
         tiles_headers -- HTTP headers to send (*default empty*)
+        download_cache -- SQLite file keeping downloaded tiles by URL (*default none*)
+        download_cache_ttl -- expiry of downloaded tiles in seconds (*default none*)
 
         stylefile -- mapnik stylesheet file (*to render tiles locally*)
 
@@ -77,6 +74,8 @@ class TilesManager(object):
         self.tiles_url = kwargs.get('tiles_url', DEFAULT_TILES_URL)
         self.tiles_subdomains = kwargs.get('tiles_subdomains', DEFAULT_TILES_SUBDOMAINS)
         self.tiles_headers = kwargs.get('tiles_headers')
+        self.download_cache = kwargs.get('download_cache')
+        self.download_cache_ttl = kwargs.get('download_cache_ttl')
 
         # Tiles rendering
         self.stylefile = kwargs.get('stylefile')
@@ -109,8 +108,12 @@ class TilesManager(object):
             if mimetype and mimetype != self.tile_format:
                 self.tile_format = mimetype
                 logger.info(_("Tile format set to %s") % self.tile_format)
+            download_cache = None
+            if self.download_cache:
+                download_cache = DownloadCache(self.download_cache, self.download_cache_ttl)
             self.reader = TileDownloader(self.tiles_url, headers=self.tiles_headers,
-                                         subdomains=self.tiles_subdomains, tilesize=self.tile_size)
+                                         subdomains=self.tiles_subdomains, tilesize=self.tile_size,
+                                         cache=download_cache)
 
         # Tile files extensions
         self._tile_extension = mimetypes.guess_extension(self.tile_format, strict=False)
@@ -207,7 +210,7 @@ class TilesManager(object):
                 # Prepare tile of overlay, if available
                 overlay = self._tile_image(layer.tile((z, x, y)))
             except (IOError, DownloadError, ExtractionError)as e:
-                logger.warn(e)
+                logger.warning(e)
                 continue
             # Extract alpha mask
             overlay = overlay.convert("RGBA")
@@ -287,7 +290,7 @@ class MBTilesBuilder(TilesManager):
         """
         if os.path.exists(self.filepath):
             if force:
-                logger.warn(_("%s already exists. Overwrite.") % self.filepath)
+                logger.warning(_("%s already exists. Overwrite.") % self.filepath)
                 os.remove(self.filepath)
             else:
                 # Already built, do not do anything.
@@ -303,7 +306,7 @@ class MBTilesBuilder(TilesManager):
             metadata = bottomlayer.reader.metadata()
             if 'bounds' in metadata:
                 logger.debug(_("Use bounds of bottom layer %s") % bottomlayer)
-                bbox = map(float, metadata.get('bounds', '').split(','))
+                bbox = [float(b) for b in metadata.get('bounds', '').split(',')]
                 zoomlevels = range(int(metadata.get('minzoom', 0)), int(metadata.get('maxzoom', 0)))
                 self.add_coverage(bbox=bbox, zoomlevels=zoomlevels)
 
@@ -326,7 +329,7 @@ class MBTilesBuilder(TilesManager):
             try:
                 self._gather((z, x, y))
             except Exception as e:
-                logger.warn(e)
+                logger.warning(e)
                 if not self.ignore_errors:
                     raise
 
@@ -1,2 +1,2 @@
 def flip_y(y, z):
-    return 2 ** z - 1 - y
+    return (1 << z) - 1 - y
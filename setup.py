@@ -18,16 +18,23 @@ setup(
     license='LPGL, see LICENSE file.',
     install_requires = [
         'mbutil',
+        'requests',
+        'urllib3 >= 2',
     ],
     extras_require = {
         'PIL':  ["Pillow"],
-        'Mapnik': ["Mapnik >= 2.0.0"]
+        'Mapnik': ["Mapnik >= 2.0.0"],
+        'speedups': ["isal", "orjson", "numpy"],
     },
     packages=find_packages(),
     include_package_data=True,
     zip_safe=False,
     keywords=['MBTiles', 'Mapnik'],
-    classifiers=['Programming Language :: Python :: 3.5',
+    python_requires='>=3.11',
+    classifiers=['Programming Language :: Python :: 3',
+                 'Programming Language :: Python :: 3.11',
+                 'Programming Language :: Python :: 3.12',
+                 'Programming Language :: Python :: 3.13',
                  'Natural Language :: English',
                  'Topic :: Utilities',
                  'Development Status :: 5 - Production/Stable'],